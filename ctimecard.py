@@ -2,14 +2,26 @@
 Convert a clockify monthly detailed report into a time card
 for the first or second part of the month.
 """
+import os
 import sys
 import pandas as pd
+from typing import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
 from argparse import ArgumentParser, Namespace
 from openpyxl import Workbook
 from openpyxl.styles import Alignment
 # from openpyxl.styles import Font, Alignment
 from timecard import Totals, read_project_list, column_name
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    # pyarrow is optional, the pandas parser is used when it is not installed
+    pa_csv = None
+
 # File containing the valid project names
 PROJECT_FILE = 'clockify_projects.txt'
 
@@ -42,49 +54,143 @@ ROW_TOTALS = 'Totals'
 ROW_FORMULAS = 'Formulas'
 
 # Column types
-UNNEEDED_COLUMNS = [COL_CLIENT, COL_DESCRIPTION, COL_TASK, COL_USER, COL_GROUP,
-                    COL_EMAIL, COL_TAGS, COL_BILLABLE, COL_START_TIME, COL_END_TIME,
-                    COL_DURATION_DEC, COL_BILLABLE_RATE, COL_BILLABLE_AMOUNT]
+# Only the needed columns are read from the input file; the rest are never parsed
+USED_COLUMNS = [COL_PROJECT, COL_START_DATE, COL_END_DATE, COL_DURATION]
+
+# Dates and durations are only compared and split, so they are read as plain strings
+COLUMN_TYPES = {COL_PROJECT: 'string', COL_START_DATE: 'string',
+                COL_END_DATE: 'string', COL_DURATION: 'string'}
 
 EMPTY_CELL = '-'
 
+# Files larger than this size (in bytes) are read in chunks. The chunks have CHUNK_SIZE rows
+# when pyarrow is not installed (pyarrow uses its own block size)
+CHUNK_FILE_SIZE = 10_000_000
+CHUNK_SIZE = 100_000
+
 
-def read_csv_file(file_name) -> pd.DataFrame:
+def read_csv_file(file_name) -> pd.DataFrame | Iterable[pd.DataFrame]:
     """
-    Read a csv file containing time tracking information into a dataframe
+    Read a csv file containing time tracking information into a dataframe.
+    Large files are not loaded in memory at once. An iterator over data frames
+    containing consecutive chunks of the file is returned instead (see read_csv_chunks).
     :param file_name: input file name
-    :return: data frame
+    :return: data frame or iterator over data frames
     """
-    df_in = pd.read_csv(file_name)
-    df_out = df_in.drop(columns=UNNEEDED_COLUMNS)
+    if os.path.getsize(file_name) > CHUNK_FILE_SIZE:
+        return read_csv_chunks(file_name)
+    try:
+        df_out = pd.read_csv(file_name, usecols=USED_COLUMNS, dtype=COLUMN_TYPES, parse_dates=False,
+                             engine='pyarrow')
+    except ImportError:
+        # pyarrow is not installed, fall back to the default parser
+        df_out = pd.read_csv(file_name, usecols=USED_COLUMNS, dtype=COLUMN_TYPES, parse_dates=False,
+                             engine='c', low_memory=False)
     return df_out
 
 
-def process_data(data: pd.DataFrame, project_list: list, start_day: int, end_day: int) -> Totals:
+def read_csv_chunks(file_name) -> Iterator[pd.DataFrame]:
     """
-    Process the data in contained in a data frame. It returns a Totals object
-    containing the processed data.
+    Read a csv file containing time tracking information in chunks.
+    The file is parsed while the chunks are consumed, so parsing errors are raised
+    by the iteration. The file is closed when the iteration ends or is abandoned.
+    :param file_name: input file name
+    :return: iterator over data frames
+    """
+    if pa_csv is None:
+        # The C parser ignores extra fields in a row when usecols is given, and does not check
+        # the first row of each chunk, so the python parser is used. All the columns are read
+        # so the number of fields is checked, and the used ones are selected afterwards.
+        with pd.read_csv(file_name, dtype=COLUMN_TYPES, parse_dates=False,
+                         engine='python', chunksize=CHUNK_SIZE) as reader:
+            for chunk in reader:
+                # An extra field in the first row makes pandas use the first column as the index
+                if not isinstance(chunk.index, pd.RangeIndex):
+                    raise ValueError(f'wrong number of fields in the first row of {file_name}')
+                yield chunk[USED_COLUMNS]
+        return
+
+    # The pyarrow streaming reader rejects rows with a wrong number of fields,
+    # the same as the pyarrow engine used for smaller files
+    convert_options = pa_csv.ConvertOptions(include_columns=USED_COLUMNS,
+                                            column_types=dict.fromkeys(USED_COLUMNS, pa.string()),
+                                            strings_can_be_null=True)
+    with pa_csv.open_csv(file_name, convert_options=convert_options) as reader:
+        for batch in reader:
+            yield batch.to_pandas().astype(COLUMN_TYPES)
+
+
+def process_data(data: pd.DataFrame | Iterable[pd.DataFrame], project_list: list,
+                 start_day: int, end_day: int) -> Totals:
+    """
+    Process the data in contained in a data frame, or in an iterable of data frames
+    when the input was read in chunks. It returns a Totals object containing the processed data.
     :param data: time data
-    :param project_list: project list
+    :param project_list: project list (or set)
     :param start_day: starting day
     :param end_day: ending day
     :return: Total object
     """
     output = Totals()
-    for index, row in data.iterrows():
-        project, start_date, end_date, hours = (row[COL_PROJECT], row[COL_START_DATE],
-                                                row[COL_END_DATE], row[COL_DURATION])
-        # print(index, project, start_date, end_date, hours)
-        if project in project_list:
-            if start_date == end_date:
-                output.add(project, start_date, hours, start_day, end_day)
-            else:
-                raise ValueError(f'date mismatch for entry ({project}) {start_date}, {end_date}')
-        else:
-            raise ValueError(f'project "{project}" not found')
+
+    # Use a set for the project membership test done for every row
+    project_set = project_list if isinstance(project_list, (set, frozenset)) else frozenset(project_list)
+
+    chunks = [data] if isinstance(data, pd.DataFrame) else data
+    for chunk in chunks:
+        process_chunk(output, chunk, project_set, start_day, end_day)
     return output
 
 
+def process_chunk(output: Totals, data: pd.DataFrame, project_set: set | frozenset,
+                  start_day: int, end_day: int):
+    """
+    Process the data contained in a data frame and add it to a Totals object.
+    :param output: Totals object where the data is accumulated
+    :param data: time data
+    :param project_set: set of valid projects
+    :param start_day: starting day
+    :param end_day: ending day
+    """
+    # Iterate over the column arrays instead of using iterrows, which builds a Series per row
+    projects = data[COL_PROJECT].to_numpy()
+    start_dates = data[COL_START_DATE].to_numpy()
+    end_dates = data[COL_END_DATE].to_numpy()
+    durations = data[COL_DURATION].to_numpy()
+
+    # Validate all the entries at once before processing them
+    unknown = data[COL_PROJECT][~data[COL_PROJECT].isin(project_set)]
+    if len(unknown):
+        raise ValueError(f'project "{unknown.iloc[0]}" not found')
+    # Missing dates are read as <NA>, which is reported as a mismatch
+    mismatch = data[COL_START_DATE].ne(data[COL_END_DATE]).fillna(True).to_numpy(dtype=bool)
+    if mismatch.any():
+        index = mismatch.argmax()
+        raise ValueError(f'date mismatch for entry ({projects[index]}) {start_dates[index]}, {end_dates[index]}')
+
+    # The start and end dates are known to be the same at this point
+    output.add_batch(projects, start_dates, durations, start_day, end_day)
+
+
+@lru_cache(maxsize=8)
+def formula_template(len_day_list: int, n_rows: int) -> tuple:
+    """
+    Return the formulas written in the last row of the timesheet (column sums).
+    The formulas only depend on the sheet dimensions, so they are cached.
+    :param len_day_list: number of days in the sheet
+    :param n_rows: number of rows in the sheet
+    :return: tuple with the formulas
+    """
+    # The column names only depend on the column number, so compute them once
+    col = [None] + [column_name(i) for i in range(1, len_day_list + 4)]
+    last_row = n_rows - 2
+    formulas = [f'=sum({col[column]}2:{col[column]}{last_row})' for column in range(1, len_day_list + 1)]
+    formulas.append('')
+    formulas.append(f'=sum({col[len_day_list + 2]}2:{col[len_day_list + 2]}{last_row})')
+    formulas.append(f'=sum({col[len_day_list + 3]}2:{col[len_day_list + 3]}{last_row})')
+    return tuple(formulas)
+
+
 def write_timesheet(time_data: Totals, project_list: list,
                     start_day: int, end_day: int, file_name: str):
     """
@@ -106,56 +212,67 @@ def write_timesheet(time_data: Totals, project_list: list,
     # Allocate three additional columns (totals, formulas and errors)
     n_rows = len(time_data.get_project_list()) + 3
 
-    day_list = list(range(start_day, end_day + 1))
-    len_day_list = len(day_list)
+    day_range = range(start_day, end_day + 1)
+    len_day_list = len(day_range)
+
+    # Name of the column with the last day (used in the row formulas)
+    col_last_day = column_name(len_day_list)
 
     # Prepare the spreadsheet heading (column titles)
-    column_titles = [COL_PROJECT] + day_list + [COL_TOTALS, COL_ERRORS, COL_FORMULAS]
-    ws.append(column_titles)
+    # All the rows are collected first and written to the sheet at the end
+    column_titles = [COL_PROJECT, *day_range, COL_TOTALS, COL_ERRORS, COL_FORMULAS]
+    all_rows = [column_titles]
 
     # Write rows with daily data
+    # Data cells containing a zero value are replaced with a special marker
+    # and their position is recorded so they can be aligned later
+    # The columns of days without hours in any project only contain empty cells,
+    # so the project hours are only looked up for the active days
     row = 2
+    empty_cells = []
+    active_days = []
+    inactive_columns = []
+    for day in day_range:
+        if time_data.get_day_totals(day) < 0.000001:
+            inactive_columns.append(day - start_day + 2)
+        else:
+            active_days.append(day)
     for project_name in project_list:
-        row_list = [project_name]
-        for day in day_list:
-            row_list.append(totals.get_hours(project_name, day))
-        hours, error = totals.get_project_totals(project_name)
+        row_list = [project_name] + [EMPTY_CELL] * len_day_list
+        empty_cells.extend((row, column) for column in inactive_columns)
+        project_hours = time_data.get_hours_dict(project_name)
+        for day in active_days:
+            hours = project_hours.get(day, 0)
+            column = day - start_day + 2
+            if hours < 0.000001:
+                empty_cells.append((row, column))
+            else:
+                row_list[column - 1] = hours
+        hours, error = time_data.get_project_totals(project_name)
         row_list.extend([hours, error])
-        row_list.append('=sum(B' + str(row) + ':' +
-                        column_name(len_day_list) + str(row) + ')')
+        row_list.append(f'=sum(B{row}:{col_last_day}{row})')
         row += 1
-        ws.append(row_list)
+        all_rows.append(row_list)
 
     # Write daily totals
     row_list = ['Totals']
-    for day in day_list:
-        row_list.append(totals.get_day_totals(day))
-    row_list.append(totals.get_total_time())
-    ws.append(row_list)
+    for day in day_range:
+        row_list.append(time_data.get_day_totals(day))
+    row_list.append(time_data.get_total_time())
+    all_rows.append(row_list)
 
     # Write column with formulas
-    row_list = [ROW_FORMULAS]
-    for column in range(1, len(day_list) + 1):
-        row_list.append('=sum(' + column_name(column) + '2:' +
-                        column_name(column) + str(n_rows - 2) + ')')
-    row_list.append('')
-    row_list.append('=sum(' + column_name(len_day_list + 2) + '2:' +
-                    column_name(len_day_list + 2) + str(n_rows - 2) + ')')
-    row_list.append('=sum(' + column_name(len_day_list + 3) + '2:' +
-                    column_name(len_day_list + 3) + str(n_rows - 2) + ')')
-    ws.append(row_list)
-
-    # Replace data cells containing a zero value with a special marker
-    # Skip the rows and columns containing totals, errors or formulas
-    for row in range(1, ws.max_row - 1):
-        for col in range(1, ws.max_column - 2):
-            # print(row, col, ws.cell(row, col).value, type(ws.cell(row, col).value))
-            try:
-                if float(ws.cell(row, col).value) < 0.000001:
-                    ws.cell(row, col).value = EMPTY_CELL
-                    ws.cell(row, col).alignment = Alignment(horizontal='right')
-            except (ValueError, TypeError):
-                pass
+    row_list = [ROW_FORMULAS, *formula_template(len_day_list, n_rows)]
+    all_rows.append(row_list)
+
+    for row_list in all_rows:
+        ws.append(row_list)
+
+    # Align the cells containing the empty cell marker to the right
+    # The same alignment object is shared by all the cells
+    right_alignment = Alignment(horizontal='right')
+    for row, column in empty_cells:
+        ws.cell(row, column).alignment = right_alignment
 
     # Save output file
     wb.save(file_name)
@@ -196,7 +313,7 @@ if __name__ == '__main__':
     args = get_args(sys.argv)
     # args = get_args(['program', 'Timesheet20240815.csv', '-s', '1', '-e', '31'])
     input_file = str(args.file)
-    output_file = 'Output_' + input_file.replace('.csv', '') + '.xlsx'
+    output_file = f'Output_{Path(input_file).stem}.xlsx'
     try:
         starting_day = int(args.start_day)
         ending_day = int(args.end_day)
@@ -205,27 +322,37 @@ if __name__ == '__main__':
         exit(0)
     print(f'Day range: [{starting_day}, {ending_day}]')
 
-    # Read project list
-    try:
-        master_project_list = read_project_list(PROJECT_FILE)
-    except FileNotFoundError as e:
-        print('Project file not found', e)
-        exit(0)
+    # Read the project list and the clockify data (into a pandas dataframe) concurrently.
+    # pandas releases the GIL while parsing the csv file.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        future_project_list = executor.submit(read_project_list, PROJECT_FILE)
+        future_df = executor.submit(read_csv_file, input_file)
+
+        try:
+            master_project_list = future_project_list.result()
+        except FileNotFoundError as e:
+            print('Project file not found', e)
+            exit(0)
 
-    # Read clockify data into a pandas dataframe
+        try:
+            df = future_df.result()
+        except ValueError as e:
+            print(e)
+            exit(0)
+
+    # Process the data. The total time per day and project
+    # is calculated at this point. Large files are parsed here,
+    # so their read errors are reported the same way.
     try:
-        df = read_csv_file(input_file)
+        totals = process_data(df, master_project_list, starting_day, ending_day)
     except ValueError as e:
         print(e)
         exit(0)
 
-    # Process the data. The total time per day and project
-    # is calculated at this point.
-    totals = process_data(df, master_project_list, starting_day, ending_day)
-
     # Get the list of projects in the data in the right order
     # aux = totals.get_project_list()
-    sorted_project_list = [_ for _ in master_project_list if _ in totals.get_project_list()]
+    used_projects = set(totals.get_project_list())
+    sorted_project_list = [_ for _ in master_project_list if _ in used_projects]
     # print(sorted_project_list)
 
     # totals.dump()
@@ -1,12 +1,15 @@
 import sys
-import re
-from typing import Any
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from functools import lru_cache
 from argparse import ArgumentParser, SUPPRESS, Namespace
 import pandas as pd
-from math import modf
-from numpy import int64, float64
+import numpy as np
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment
+from timecard import closest_fraction_array
 
 # Project file name
 PROJECT_FILE = 'projects.txt'
@@ -26,8 +29,20 @@ ROW_TOTALS = 'Totals'
 ROW_FORMULAS = 'Formulas'
 
 # Column types
-UNNEEDED_COLUMNS = [COL_PROJECT_CODE, COL_BILLABLE, COL_BILLABLE_AMOUNT]
-NON_INPUT_DATA_COLUMNS = [COL_PROJECT_PATH, COL_TOTAL_HOURS, COL_TOTALS, COL_ERRORS]
+UNNEEDED_COLUMNS = frozenset([COL_PROJECT_CODE, COL_BILLABLE, COL_BILLABLE_AMOUNT])
+NON_INPUT_DATA_COLUMNS = frozenset([COL_PROJECT_PATH, COL_TOTAL_HOURS, COL_TOTALS, COL_ERRORS])
+
+# Columns excluded from the totals (the errors are included in the recalculations)
+NON_SUM_COLUMNS = NON_INPUT_DATA_COLUMNS - {COL_ERRORS}
+
+# Reference used to convert the date/time values read from an Excel spreadsheet into hours.
+# Excel stores times as fractions of a day and shows times bigger than 24 hours as
+# dates in the first days of January 1900 (counted from 1899-12-31).
+EXCEL_TIME_EPOCH = pd.Timestamp('1899-12-31')
+ONE_HOUR = pd.Timedelta(hours=1)
+
+# Letters used to build Excel column names
+COLUMN_LETTERS = tuple('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
 
 # Font name used to format cells
 FONT_NAME = 'Liberation Sans'
@@ -39,65 +54,30 @@ def dump_data(df: pd.DataFrame, label='', print_types=False):
     Used for testing purposes.
     :param df: pandas data frame
     :param label: label to print in output header
-    :param print_types: print data types along with values
+    :param print_types: print the data type of each cell after the values
     """
     assert (isinstance(df, pd.DataFrame))
     aux = '-- ' + label + ' ' if label else ''
     delimiter = aux + '-' * 100
     print(delimiter)
-    print('+ ', end='')
-    for col in df.keys():
-        print('[' + str(col) + ']', end=' ')
-    print('\n')
-    for row in list(df.index.values):
-        for col in df.keys():
-            value = df.at[row, col]
-            if print_types:
-                print('[' + str(value) + ' ' + str(type(value)) + ']', end=' ')
-            else:
-                print('[' + str(value) + ']', end=' ')
+    print(df.to_string())
+    if print_types:
         print()
+        # DataFrame.map was called applymap before pandas 2.1
+        map_cells = df.map if hasattr(df, 'map') else df.applymap
+        print(map_cells(lambda value: type(value).__name__).to_string())
     print()
 
 
-def closest_number(x: Any):
-    """
-    Return the closest real to a given number whose fractional part is either 0, 0.25, 0.5 or 0.75.
-    :param x: number to approximate
-    :return: tuple with closest number and difference between the two
-    """
-    xf, xi = modf(x)
-    if xf > 0.875:
-        xi += 1
-        xf = 0
-    elif xf > 0.675:
-        xf = 0.75
-    elif xf > 0.375:
-        xf = 0.5
-    elif xf > 0.125:
-        xf = 0.25
-    else:
-        xf = 0
-    xt = xi + xf
-    dx = x - xt if abs(x - xt) > 1.0E-4 else 0
-    return xt, dx
-
-
 def read_project_list(file_name: str) -> list:
     """
     Read the contents of the file with the list of valid projects.
+    Empty lines and comments (lines starting with #) are ignored.
     :param file_name: project list file name
     :return: list of projects
     """
-    output_list = []
-    f = open(file_name, 'r')
-    for line in f:
-        line = line.strip()
-        if not re.search('^#', line) or len(line) == 0:
-            # print(line)
-            output_list.append(line)
-    # print(lst)
-    return output_list
+    with open(file_name, 'r') as f:
+        return [line for line in (raw_line.strip() for raw_line in f) if line and not line.startswith('#')]
 
 
 def check_projects(df: pd.DataFrame, project_list: list) -> bool:
@@ -108,13 +88,12 @@ def check_projects(df: pd.DataFrame, project_list: list) -> bool:
     :return: False if a project is not in the master list, False otherwise
     """
     assert (isinstance(df, pd.DataFrame))
-    ok = True
-    for _, row in df.iterrows():
-        project_name = row[COL_PROJECT_PATH]
-        if project_name not in project_list and project_name != ROW_TOTALS:
-            print(project_name + ' not in project list')
-            ok = False
-    return ok
+    valid_projects = set(project_list)
+    valid_projects.add(ROW_TOTALS)
+    bad_projects = df.loc[~df[COL_PROJECT_PATH].isin(valid_projects), COL_PROJECT_PATH]
+    for project_name in bad_projects:
+        print(project_name + ' not in project list')
+    return bad_projects.empty
 
 
 def read_excel_file(file_name: str) -> pd.DataFrame:
@@ -124,53 +103,102 @@ def read_excel_file(file_name: str) -> pd.DataFrame:
     :return: pandas data frame
     :rtype: pd.DataFrame
     """
-    df = pd.read_excel(file_name)
-
-    # Drop unused columns
-    df_out = df.drop(columns=UNNEEDED_COLUMNS)
+    # Unused columns are skipped while reading
+    try:
+        df_out = pd.read_excel(file_name, usecols=lambda col_name: col_name not in UNNEEDED_COLUMNS,
+                               engine='calamine')
+    except (ImportError, ValueError):
+        # python-calamine is not installed (ImportError) or pandas is older than 2.2 and
+        # does not know the calamine engine (ValueError). Fall back to the default (openpyxl)
+        # reader, which raises its own error if the file itself cannot be read.
+        df_out = pd.read_excel(file_name, usecols=lambda col_name: col_name not in UNNEEDED_COLUMNS)
 
     # Look for the row containing the column totals
-    lst = df_out.index[df_out[COL_PROJECT_PATH] == ROW_TOTALS].tolist()
-    if len(lst) == 1:
-        index = lst[0]
-    else:
-        raise (ValueError, 'No totals')
+    is_totals = df_out[COL_PROJECT_PATH].eq(ROW_TOTALS)
+    if is_totals.sum() != 1:
+        raise ValueError('No totals')
+    index = is_totals.idxmax()
 
     # Only return rows up to the totals
-    return df_out[0:index + 1]
+    # The project names are stored as a categorical column since they are compared several times
+    df_out = df_out[0:index + 1].copy()
+    df_out[COL_PROJECT_PATH] = df_out[COL_PROJECT_PATH].astype('category')
+    return df_out
 
 
 def convert_values(df: pd.DataFrame) -> pd.DataFrame:
     """
     Convert hh:mm data to decimal, making sure that times bigger than 24 hours are handled correctly.
     Convert all numeric cells to int64 or float64 data.
+    The input data frame is modified in place.
     :param df: data frame
-    :return: converted data frame
+    :return: converted data frame (same object as the input)
     """
     assert (isinstance(df, pd.DataFrame))
 
-    # Make a copy of the data frame so the original is left untouched
-    df_out = df.copy(deep=True)
+    # The data frame is modified in place to avoid copying it
+    df_out = df
 
-    for row_index, _ in df_out.iterrows():
-        for col_name in df_out.keys():
-            value = df_out.at[row_index, col_name]
-            try:
-                h, m = map(int, str(value).split(':'))
-                result = h + m / 60.0
-                df_out.at[row_index, col_name] = result
-            except ValueError:
-                pass
+    # Convert the hh:mm values one column at a time. Values that are not
+    # of the form hh:mm are left unchanged.
+    for col_name in df_out.keys():
+        if col_name == COL_PROJECT_PATH:
+            continue
+        df_out[col_name] = convert_hours(df_out[col_name])
 
     # Then convert all columns (except for the project name/path) to the same data type
-    # (should be numpy.float64)
-    for col_name in df_out.keys():
-        if col_name != COL_PROJECT_PATH:
-            df_out[col_name] = pd.to_numeric(df_out[col_name])
+    # (should be numpy.float64) in a single call
+    numeric_cols = [col_name for col_name in df_out.keys() if col_name != COL_PROJECT_PATH]
+    df_out[numeric_cols] = df_out[numeric_cols].apply(pd.to_numeric)
 
     return df_out
 
 
+def convert_hours(values: pd.Series) -> pd.Series:
+    """
+    Convert the hh:mm values in a column to decimal hours. The time, date/time and time
+    difference values found in Excel spreadsheets are converted as well.
+    Values that are not of the form hh:mm are left unchanged.
+    :param values: column values
+    :return: converted values
+    """
+    if pd.api.types.is_timedelta64_dtype(values):
+        return values / ONE_HOUR
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return (values - EXCEL_TIME_EPOCH) / ONE_HOUR
+    if values.dtype == object:
+        values = convert_excel_times(values)
+
+    parts = values.astype(str).str.split(':', n=1, expand=True)
+    if len(parts.columns) < 2:
+        return values
+    h = pd.to_numeric(parts[0], errors='coerce')
+    m = pd.to_numeric(parts[1], errors='coerce')
+    result = h + m / 60.0
+    return result.where(result.notna(), values)
+
+
+def convert_excel_times(values: pd.Series) -> pd.Series:
+    """
+    Convert the time, date/time and time difference objects in a column to decimal hours.
+    Each kind of object is converted with a single call. All other values are left unchanged.
+    :param values: column values
+    :return: converted values
+    """
+    kinds = values.map(type)
+    is_time = kinds == dt.time
+    is_timedelta = kinds.map(lambda kind: issubclass(kind, dt.timedelta))
+    is_datetime = kinds.map(lambda kind: issubclass(kind, dt.datetime))
+    if not (is_time.any() or is_timedelta.any() or is_datetime.any()):
+        return values
+
+    hours = pd.Series(np.nan, index=values.index)
+    hours[is_time] = pd.to_timedelta(values[is_time].astype(str)) / ONE_HOUR
+    hours[is_timedelta] = pd.to_timedelta(values[is_timedelta]) / ONE_HOUR
+    hours[is_datetime] = (pd.to_datetime(values[is_datetime]) - EXCEL_TIME_EPOCH) / ONE_HOUR
+    return hours.where(is_time | is_timedelta | is_datetime, values)
+
+
 def rename_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
     Rename date of the week, which originally are of the form 'dow yyyy-mm-dd', to 'dow day'.
@@ -189,31 +217,50 @@ def rename_columns(df: pd.DataFrame) -> pd.DataFrame:
     return df_out
 
 
+def round_values(values: np.ndarray) -> tuple:
+    """
+    Round a block of time data to the nearest 15 minute boundary (x.0 x.25, xx.5, x.75).
+    Shared by round_data and process_data.
+    :param values: row-major array with the data cells
+    :return: tuple with the rounded values and the rounding error of every row
+    """
+    new_values, errors = closest_fraction_array(values)
+    return new_values, errors.sum(axis=1)
+
+
+def calculate_totals(body: np.ndarray) -> tuple:
+    """
+    Calculate the row, column and grand totals of a block of project data.
+    Missing values count as zero. Shared by recalculate_totals and process_data.
+    :param body: row-major array with the project rows (the totals row is not included)
+    :return: tuple with the row totals, the column totals and the grand total
+    """
+    row_totals = np.nansum(body, axis=1)
+    return row_totals, np.nansum(body, axis=0), row_totals.sum()
+
+
 def round_data(df: pd.DataFrame) -> pd.DataFrame:
     """
     Round time data to the nearest 15 minute boundary (x.0 x.25, xx.5, x.75).
     The rounding errors are recorded into the (new) 'Errors' column.
     The row and column totals become inconsistent after this point.
+    The input data frame is modified in place.
     :param df: input data frame
-    :return: converted data frame
+    :return: converted data frame (same object as the input)
     """
     assert (isinstance(df, pd.DataFrame))
 
-    # Make a copy of the data frame so the original is left untouched
-    df_out = df.copy(deep=True)
+    # The data frame is modified in place to avoid copying it
+    df_out = df
 
-    # First round out every data cell to the nearest number.
+    # Round out every data cell to the nearest number in one operation over the whole data block.
     # Keep track of the errors for the row in the errors column.
-    for row_index, _ in df_out.iterrows():
-        total_error = 0
-        for col_name in df_out.keys():
-            if col_name not in NON_INPUT_DATA_COLUMNS:
-                # value = df_out.at[row, col]
-                new_value, error = closest_number(df_out.at[row_index, col_name])
-                df_out.at[row_index, col_name] = new_value
-                total_error += error
-                # print(row, col, value, new_value, error, total_error)
-        df_out.at[row_index, COL_ERRORS] = total_error
+    data_cols = [col_name for col_name in df_out.keys() if col_name not in NON_INPUT_DATA_COLUMNS]
+    # Use a row-major array so the row sums run along contiguous memory
+    values = np.ascontiguousarray(df_out[data_cols].to_numpy(dtype=np.float64))
+    new_values, row_errors = round_values(values)
+    df_out[data_cols] = new_values
+    df_out[COL_ERRORS] = row_errors
 
     return df_out
 
@@ -222,114 +269,108 @@ def recalculate_totals(df: pd.DataFrame) -> pd.DataFrame:
     """
     Recalculate the row and column totals. This funtion should be called
     after calling round_data so the totals are consistent with the data.
+    The input data frame is modified in place.
     :param df: input data frame
-    :return: converted data frame
+    :return: converted data frame (same object as the input)
     """
     assert (isinstance(df, pd.DataFrame))
 
-    # Make a copy of the data frame so the original is left untouched
-    df_out = df.copy(deep=True)
+    # The data frame is modified in place to avoid copying it
+    df_out = df
 
-    # Include the errors in the recalculations
-    column_list = NON_INPUT_DATA_COLUMNS.copy()
-    column_list.remove(COL_ERRORS)
-    # print(column_list)
-
-    # Calculate the row totals
-    col_total = {col_name: 0.0 for col_name in df_out.keys()}
-    # print(col_total)
-    big_total = 0.0
-    for row_index, row in df_out.iterrows():
-        if row[COL_PROJECT_PATH] == ROW_TOTALS:  # it doesn't make sense to update this row yet
-            continue
-        row_total = 0.0
-        for col_name in df_out.keys():
-            # if col_name not in NON_INPUT_DATA_COLUMNS:
-            if col_name not in column_list:
-                # print(col_name)
-                row_total += df_out.at[row_index, col_name]
-                col_total[col_name] += df_out.at[row_index, col_name]
-        big_total += row_total
-        # print(row_total)
-
-        df_out.at[row_index, COL_TOTALS] = row_total
-
-    # Update column totals
-    row = df_out.loc[df_out[COL_PROJECT_PATH] == ROW_TOTALS]
-    row_index = row.index[0]
-    # print(row)
-    # print('--', row.index)
-    for col_name in df_out.keys():
-        # if col_name not in NON_INPUT_DATA_COLUMNS:
-        if col_name not in column_list:
-            df_out.at[row_index, col_name] = col_total[col_name]
+    # Select the rows with project data. It doesn't make sense to include the totals row yet.
+    # The errors are included in the recalculations.
+    sum_cols = [col_name for col_name in df_out.keys() if col_name not in NON_SUM_COLUMNS]
+    totals_mask = df_out[COL_PROJECT_PATH] == ROW_TOTALS
+    # The sums are done on a row-major array extracted once
+    body = np.ascontiguousarray(df_out.loc[~totals_mask, sum_cols].to_numpy(dtype=np.float64))
+    row_totals, column_totals, grand_total = calculate_totals(body)
 
-    # Update total hours for period
-    df_out.at[row_index, COL_TOTALS] = big_total
+    # Update the row totals, the column totals and the total hours for period
+    df_out.loc[~totals_mask, COL_TOTALS] = row_totals
+    df_out.loc[totals_mask, sum_cols] = column_totals
+    df_out.loc[totals_mask, COL_TOTALS] = grand_total
 
     return df_out
 
 
-def convert_value(value: Any) -> Any:
+def process_data(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Converts numpy.float64 values to float and replaces zero data with a '-'.
-    All other data types are left unchanged.
-    :param value: input value
-    :return: converted value
+    Convert, rename, round and recalculate the totals of the input data.
+    The result is the same as calling convert_values, rename_columns, round_data and
+    recalculate_totals in sequence, but the data block is extracted only once and
+    the rounded values and totals are assigned to the data frame in a single step.
+    :param df: input data frame
+    :return: processed data frame
     """
-    # print('convert value', value, type(value))
-    if isinstance(value, float64) or isinstance(value, int64):
-        output_value = float(value)
-        if abs(output_value) < 0.0001:
-            output_value = '-'
-        # print('found float64')
-    else:
-        output_value = value
-    return output_value
+    assert (isinstance(df, pd.DataFrame))
 
+    # The renamed data frame is a copy, so it can be converted in place
+    df_out = convert_values(rename_columns(df))
+    data_cols = [col_name for col_name in df_out.keys() if col_name not in NON_INPUT_DATA_COLUMNS]
+
+    # Round the data and keep track of the rounding errors for every row (see round_data)
+    values = np.ascontiguousarray(df_out[data_cols].to_numpy(dtype=np.float64))
+    new_values, row_errors = round_values(values)
+
+    # Recalculate the totals using the project rows only, with the errors
+    # as the last column (see recalculate_totals)
+    totals_mask = (df_out[COL_PROJECT_PATH] == ROW_TOTALS).to_numpy()
+    body = np.column_stack((new_values[~totals_mask], row_errors[~totals_mask]))
+    row_totals, column_totals, grand_total = calculate_totals(body)
+    new_values[totals_mask] = column_totals[:-1]
+    row_errors[totals_mask] = column_totals[-1]
+    totals = np.empty(len(df_out), dtype=np.float64)
+    totals[~totals_mask] = row_totals
+    totals[totals_mask] = grand_total
+
+    df_out[data_cols] = new_values
+    df_out[COL_TOTALS] = totals
+    df_out[COL_ERRORS] = row_errors
 
-def get_row_and_index(df: pd.DataFrame, name: str) -> tuple:
-    """
-    Auxiliary function that returns the row and the row index for the row where COL_PROJECT_PATH matches a given name.
-    Provided to prevent code redundancy in the program.
-    :param df: data frame
-    :param name: name to match
-    :return: row and row index
-    """
-    assert (isinstance(df, pd.DataFrame))
-    row = df.loc[df[COL_PROJECT_PATH] == name]
-    row_index = row.index[0]
-    return row, row_index
+    return df_out
 
 
-def get_row_columns(df: pd.DataFrame, row_index: int, output_row_index: int, column_names: list) -> list:
+def get_row_columns(row: np.ndarray, output_row_index: int, formulas_column: int, col_last_day: str) -> list:
     """
-    Return the column values for a given row index. The output row index will be used
+    Return the column values for a given row. The output row index will be used
     when calculating the formulas since the order of rows in the output spreadsheet is
     not necessarily the same as the order of rows in the input data. The formula will
-    be empty if the output
-    :param df: data frame
-    :param column_names: list of column names
-    :param row_index: row index (zero indexed)
+    be empty if the output row index is None.
+    :param row: row values, already converted for output (see convert_cells)
     :param output_row_index: output row index (used in formulas)
+    :param formulas_column: position of the formulas column in the output row (zero indexed)
+    :param col_last_day: name of the column with the last day (used in formulas)
     :return: list of column values for the row
     """
-    n = 0
-    column_values = []
-    for col_name in column_names:
-        if col_name == COL_FORMULAS:
-            if output_row_index is not None:
-                value = '=sum(B' + str(output_row_index + 2) + ':' + excel_column_name(n - 2) + str(
-                    output_row_index + 2) + ')'
-            else:
-                value = ''
-        else:
-            value = convert_value(df.at[row_index, col_name])
-        column_values.append(value)
-        n += 1
+    column_values = row.tolist()
+    if output_row_index is not None:
+        output_row = output_row_index + 2
+        value = f'=sum(B{output_row}:{col_last_day}{output_row})'
+    else:
+        value = ''
+    column_values.insert(formulas_column, value)
     return column_values
 
 
+def convert_cells(df: pd.DataFrame, column_names: list) -> np.ndarray:
+    """
+    Extract the values of a list of columns for output. Numeric values are converted
+    to float and values that are too small to be displayed are set to zero (see write_excel_file).
+    All other columns are left unchanged.
+    :param df: data frame
+    :param column_names: list of column names
+    :return: array of values (one row per data frame row)
+    """
+    cells = df[column_names].to_numpy(dtype=object)
+    numeric = [n for n, col_name in enumerate(column_names) if pd.api.types.is_numeric_dtype(df[col_name])]
+    block = df[[column_names[n] for n in numeric]].to_numpy(dtype=np.float64)
+    block[np.abs(block) < 0.0001] = 0.0
+    cells[:, numeric] = block.astype(object)
+    return cells
+
+
+@lru_cache(maxsize=None)
 def excel_column_name(column_number: int) -> str:
     """
     Convert a zero-indexed column number into an Excel column name.
@@ -337,18 +378,15 @@ def excel_column_name(column_number: int) -> str:
     :return: column name
     """
     assert (isinstance(column_number, int))
-    column_list = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I',
-                   'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R',
-                   'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z']
-    max_columns = len(column_list)
+    if column_number < 0:
+        raise ValueError(f'Bad column number {column_number}')
 
-    if column_number < max_columns:
-        col_name = column_list[column_number]
-    else:
-        r = column_number // max_columns
-        if r > max_columns:
-            raise ValueError('column number too large')
-        col_name = column_list[r - 1] + column_list[column_number - max_columns * r]
+    # Bijective base 26 conversion (A..Z, AA..ZZ, AAA...)
+    col_name = ''
+    n = column_number + 1
+    while n:
+        n, r = divmod(n - 1, len(COLUMN_LETTERS))
+        col_name = COLUMN_LETTERS[r] + col_name
 
     return col_name
 
@@ -362,108 +400,123 @@ def write_excel_file(df: pd.DataFrame, project_list: list, file_name: str):
     """
     assert (isinstance(df, pd.DataFrame))
 
-    # Create workbook and define basic attributes
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Timecard'
+    # Map the project names to their row position once, instead of searching the data frame for each project.
+    # The first row is used if a name appears more than once.
+    name_to_index = {}
+    for row_index, name in enumerate(df[COL_PROJECT_PATH].to_numpy()):
+        name_to_index.setdefault(name, row_index)
 
     # Get spreadsheet dimensions
     # Allocate two additional rows (column titles, and formulas)
     # Allocate an additional column for the formulas
-    # row = df.loc[df[COL_PROJECT_PATH] == ROW_TOTALS]
-    row, _ = get_row_and_index(df, ROW_TOTALS)
-    n_rows = row.index[0] + 3  # row.index[0] is zero indexed
+    n_rows = name_to_index[ROW_TOTALS] + 3  # row positions are zero indexed
     n_cols = len(df.keys()) + 1
     # print(n_rows, n_cols)
 
+    # The rows are collected first and written at the end
+    all_rows = []
+
     # Prepare the spreadsheet heading (column titles)
-    column_titles = list(df.keys()).copy()
-    column_titles = column_titles[:-1] + [COL_FORMULAS, COL_ERRORS]
-    ws.append(column_titles)
+    column_titles = [*df.keys()[:-1], COL_FORMULAS, COL_ERRORS]
+    all_rows.append(column_titles)
+
+    # Extract the values of all the data columns at once. Rows are then accessed by position.
+    data_columns = [col_name for col_name in column_titles if col_name != COL_FORMULAS]
+    # The numeric values are converted for output at the same time.
+    values = convert_cells(df, data_columns)
+    formulas_column = column_titles.index(COL_FORMULAS)
+
+    # The column names only depend on the column number, so compute them once
+    col_names = [excel_column_name(col_number) for col_number in range(n_cols + 1)]
+    col_last_day = col_names[formulas_column - 2]
 
     # Append the time data
     # Some formulas are inserted here
     project_row_index = 0
     for project_name in project_list:
         try:
-            row, row_index = get_row_and_index(df, project_name)
-        except IndexError:
+            row_index = name_to_index[project_name]
+        except KeyError:
             # print('ignoring', project_name, project_row_index)
             continue
-        row_list = get_row_columns(df, row_index, project_row_index, column_titles)
+        row_list = get_row_columns(values[row_index], project_row_index, formulas_column, col_last_day)
         project_row_index += 1
-        ws.append(row_list)
+        all_rows.append(row_list)
 
     # Append the row with the column totals
-    row, row_index = get_row_and_index(df, ROW_TOTALS)
-    row_list = get_row_columns(df, row_index, 0, column_titles)
-    ws.append(row_list)
+    row_index = name_to_index[ROW_TOTALS]
+    row_list = get_row_columns(values[row_index], 0, formulas_column, col_last_day)
+    all_rows.append(row_list)
 
     # -- Formulas start here
 
     # Append the row containing the column totals (formulas)
     column_list = column_titles[1:-2]  # remove project name, totals and errors
     # print(column_list)
-    row_list = [ROW_FORMULAS]
-    for col_number in range(1, len(column_list) + 1):
-        # print(col_number, excel_column_name(col_number))
-        row_list.append('=sum(' + excel_column_name(col_number) + '2:' +
-                        excel_column_name(col_number) + str(n_rows - 2) + ')')
+    last_row = n_rows - 2
+    row_list = [ROW_FORMULAS] + [f'=sum({name}2:{name}{last_row})' for name in col_names[1:len(column_list) + 1]]
     # Sum of all column totals
-    row_list.append('=sum(B' + str(n_rows) + ':' +
-                    excel_column_name(len(column_list) - 1) + str(n_rows) + ')')
-    ws.append(row_list)
-
-    # -- Font definitions start here
-
-    # Change the font in all relevant cells
-    ft = Font(name=FONT_NAME)
-    for row_number in range(1, n_rows + 1):
-        for col_number in range(0, n_cols):
-            # print(excel_column_name(col_number) + str(row_number))
-            ws[excel_column_name(col_number) + str(row_number)].font = ft
-
-    # Format titles in bold
-    ft = Font(name=FONT_NAME, bold=True)
-    for col_number in range(0, n_cols):
-        # print(excel_column_name(col_number) + '1')
-        ws[excel_column_name(col_number) + '1'].font = ft
-
-    # Format totals in bold. Use the same font definition used for the titles.
-    for col_number in range(1, n_cols - 1):
-        # print(excel_column_name(col_number) + str(n_rows - 1))
-        ws[excel_column_name(col_number) + str(n_rows)].font = ft
-    for row_number in range(1, n_rows):
-        # print(excel_column_name(n_cols - 3) + str(row_number))
-        ws[excel_column_name(n_cols - 3) + str(row_number)].font = ft
-
-    # Change format and color in the formulas
-    ft = Font(name=FONT_NAME, bold=True, italic=True, color="FF0000")
-    for col_number in range(1, len(column_list) + 2):
-        # print(excel_column_name(col_number))
-        ws[excel_column_name(col_number) + str(n_rows)].font = ft
-    for row_number in range(2, n_rows):
-        # print(row_number)
-        ws[excel_column_name(n_cols - 2) + str(row_number)].font = ft
-
-    # -- Alignment and numeric format start here
-
-    # Align numeric cells to the right
-    for row_number in range(1, n_rows):
-        for col_number in range(1, n_cols):
-            # print(excel_column_name(col_number) + str(row_number))
-            ws[excel_column_name(col_number) + str(row_number)].alignment = Alignment(horizontal='right')
-
-    # Make numbers display with two decimals
-    for row_number in range(1, n_rows + 1):
-        for col_number in range(1, n_cols - 1):
-            # print(excel_column_name(col_number) + str(row_number))
-            ws[excel_column_name(col_number) + str(row_number)].number_format = '0.00'
-
-    # Make errors display with four decimals
-    for row_number in range(1, n_rows):
-        # print(excel_column_name(n_cols - 1) + str(row_number))
-        ws[excel_column_name(n_cols - 1) + str(row_number)].number_format = '0.0000'
+    row_list.append(f'=sum(B{n_rows}:{col_names[len(column_list) - 1]}{n_rows})')
+    all_rows.append(row_list)
+
+    # -- Formatting starts here
+
+    # The style objects are created once and shared by all the cells
+    base_font = Font(name=FONT_NAME)
+    bold_font = Font(name=FONT_NAME, bold=True)
+    formula_font = Font(name=FONT_NAME, bold=True, italic=True, color="FF0000")
+    right_alignment = Alignment(horizontal='right')
+
+    # Create a write-only workbook. Rows are streamed to the file instead
+    # of keeping every cell in memory, so cells are formatted before they are
+    # appended to the sheet.
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Timecard')
+
+    # Format each cell while writing the rows. Rows shorter than the sheet are
+    # padded with empty (formatted) cells.
+    # - titles are in bold
+    # - totals are in bold (last row and totals column)
+    # - formulas are in bold, italic and red (formulas row and column)
+    # - numeric cells are aligned to the right and display two decimals
+    # - errors display four decimals
+    # - zero values are displayed as a '-' (the cells remain numeric)
+    formulas_row_last_col = len(column_list) + 2
+    totals_col = n_cols - 2
+    formulas_col = n_cols - 1
+    errors_col = n_cols
+    for row_number, row_list in enumerate(all_rows, start=1):
+        cells = []
+        for col_number in range(1, n_cols + 1):
+            value = row_list[col_number - 1] if col_number <= len(row_list) else None
+            cell = WriteOnlyCell(ws, value=value)
+
+            if row_number == 1:
+                cell.font = bold_font
+            elif row_number == n_rows:
+                if 2 <= col_number <= formulas_row_last_col:
+                    cell.font = formula_font
+                elif 2 <= col_number < n_cols:
+                    cell.font = bold_font
+                else:
+                    cell.font = base_font
+            elif col_number == formulas_col:
+                cell.font = formula_font
+            elif col_number == totals_col:
+                cell.font = bold_font
+            else:
+                cell.font = base_font
+
+            if col_number > 1:
+                if row_number < n_rows:
+                    cell.alignment = right_alignment
+                if col_number < errors_col:
+                    cell.number_format = '0.00;-0.00;"-"'
+                elif row_number < n_rows:
+                    cell.number_format = '0.0000;-0.0000;"-"'
+
+            cells.append(cell)
+        ws.append(cells)
 
     # Save output file
     wb.save(file_name)
@@ -491,24 +544,29 @@ def get_args(argv: list) -> Namespace:
     return parser.parse_args(argv[1:])
 
 
-def read_csv_file(file_name):
-    df = pd.read_csv(file_name)
-
-    # Drop unused columns
-    df_out = df.drop(columns=UNNEEDED_COLUMNS)
+def read_csv_file(file_name: str) -> pd.DataFrame:
+    """
+    Read csv file into a Pandas data frame
+    :param file_name: csv file name
+    :return: pandas data frame
+    """
+    # Unused columns are skipped while reading
+    df_out = pd.read_csv(file_name, usecols=lambda col_name: col_name not in UNNEEDED_COLUMNS)
 
     # Look for the row containing the column totals
-    lst = df_out.index[df_out[COL_PROJECT_PATH] == ROW_TOTALS].tolist()
-    if len(lst) == 1:
-        index = lst[0]
-    else:
-        raise (ValueError, 'No totals')
+    is_totals = df_out[COL_PROJECT_PATH].eq(ROW_TOTALS)
+    if is_totals.sum() != 1:
+        raise ValueError('No totals')
+    index = is_totals.idxmax()
 
     # print(df_out[0:index + 1])
     # return
 
     # Only return rows up to the totals
-    return df_out[0:index + 1]
+    # The project names are stored as a categorical column since they are compared several times
+    df_out = df_out[0:index + 1].copy()
+    df_out[COL_PROJECT_PATH] = df_out[COL_PROJECT_PATH].astype('category')
+    return df_out
 
 
 if __name__ == '__main__':
@@ -517,24 +575,29 @@ if __name__ == '__main__':
     args = get_args(sys.argv)
     # args = get_args(['ptimecard', 'example.csv', '--debug'])
     input_file = args.file
-    output_file = 'Output_' + str(input_file).replace('.csv', '') + '.xlsx'
+    output_file = f'Output_{Path(input_file).stem}.xlsx'
     debug = args.debug
 
+    # Read the project list and the input file concurrently
     master_project_list = []  # to make pycharm happy
-    try:
-        master_project_list = read_project_list(PROJECT_FILE)
-    except FileNotFoundError as e:
-        print('Project file not found', e)
-        exit(0)
-    if debug:
-        print(master_project_list)
-
     data_frame_excel = None  # to make pycharm happy
-    try:
-        data_frame_excel = read_csv_file(input_file)
-    except Exception as e:
-        print('Cannot open spreadsheet', e)
-        exit(0)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        future_project_list = executor.submit(read_project_list, PROJECT_FILE)
+        future_data_frame = executor.submit(read_csv_file, input_file)
+
+        try:
+            master_project_list = future_project_list.result()
+        except FileNotFoundError as e:
+            print('Project file not found', e)
+            exit(0)
+        if debug:
+            print(master_project_list)
+
+        try:
+            data_frame_excel = future_data_frame.result()
+        except Exception as e:
+            print('Cannot open spreadsheet', e)
+            exit(0)
 
     if debug:
         dump_data(data_frame_excel, label='read_excel', print_types=True)
@@ -542,23 +605,27 @@ if __name__ == '__main__':
     if not check_projects(data_frame_excel, master_project_list):
         exit(0)
 
-    data_frame_convert = convert_values(data_frame_excel)
     if debug:
-        dump_data(data_frame_convert, 'convert_values', print_types=True)
+        # Run the processing steps one at a time so the intermediate results can be dumped.
+        # The processing functions modify the data frame in place,
+        # so no references to the intermediate results are kept
+        data_frame = convert_values(data_frame_excel)
+        del data_frame_excel
+        dump_data(data_frame, 'convert_values', print_types=True)
 
-    data_frame_rename = rename_columns(data_frame_convert)
-    if debug:
-        dump_data(data_frame_rename, label='rename_columns')
+        data_frame = rename_columns(data_frame)
+        dump_data(data_frame, label='rename_columns')
 
-    data_frame_round = round_data(data_frame_rename)
-    if debug:
-        dump_data(data_frame_round, label='round_data')
+        data_frame = round_data(data_frame)
+        dump_data(data_frame, label='round_data')
 
-    data_frame_recalculate = recalculate_totals(data_frame_round)
-    if debug:
-        dump_data(data_frame_recalculate, label='recalculate_totals')
+        data_frame = recalculate_totals(data_frame)
+        dump_data(data_frame, label='recalculate_totals')
+    else:
+        data_frame = process_data(data_frame_excel)
+        del data_frame_excel
 
     try:
-        write_excel_file(data_frame_recalculate, master_project_list, output_file)
+        write_excel_file(data_frame, master_project_list, output_file)
     except Exception as e:
         print('Cannot write spreadsheet', e)
@@ -1,22 +1,36 @@
 """
 Auxiliary routines used in the time card programs
 """
-import re
+import numpy as np
 from math import modf
+from typing import Sequence
+from functools import lru_cache
 from calendar import monthrange
 from datetime import datetime
 
+# Thresholds and values used to round the fractional part of the data (see closest_fraction)
+ROUNDING_THRESHOLDS = np.array([0.125, 0.375, 0.675, 0.875])
+ROUNDING_FRACTIONS = np.array([0.0, 0.25, 0.5, 0.75, 1.0])
+
+# Spreadsheet column names (enough for a full month plus the totals, errors and formulas columns)
+COLUMN_NAMES = ('A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M',
+                'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z',
+                'AA', 'AB', 'AC', 'AD', 'AE', 'AF', 'AG', 'AH', 'AI', 'AJ', 'AK')
+
 
 class Totals:
 
     def __init__(self):
         self.data = {}
         self.day_totals = {}
-        self.project_totals = {}
+        # The project hours and rounding errors are kept in separate dictionaries
+        # so no tuple has to be built every time a project is updated
+        self.project_hours = {}
+        self.project_errors = {}
         self.reference_date = None
 
     def __len__(self):
-        return len(self.data)
+        return sum(len(hours) for hours in self.data.values())
 
     def add(self, project: str, date: str, time: str, start_day: int, end_day: int):
         """
@@ -28,7 +42,7 @@ class Totals:
         :param end_day: ending day
         """
 
-        dt = datetime.strptime(date, '%d/%m/%Y')
+        dt = parse_date(date)
         if self.reference_date is None:
             self.reference_date = dt
 
@@ -38,29 +52,54 @@ class Totals:
 
         hours, new_error = closest_fraction(convert_time(time))
         # print(project, date, time, hours, new_error)
+        self.add_hours(project, dt.day, hours, new_error)
+
+    def add_batch(self, projects: Sequence, dates: Sequence, times: Sequence, start_day: int, end_day: int):
+        """
+        Add time data for several records at once. The records outside the day range are
+        dropped before their times are converted, and the remaining times are rounded in a
+        single operation. The result is the same as calling add for each record in order.
+        :param projects: project names
+        :param dates: dates
+        :param times: times
+        :param start_day: starting day
+        :param end_day: ending day
+        """
+        parsed_dates = [parse_date(date) for date in dates]
+        if self.reference_date is None and parsed_dates:
+            self.reference_date = parsed_dates[0]
+
+        # Select the days that are within the day range
+        selected = [n for n, dt in enumerate(parsed_dates) if start_day <= dt.day <= end_day]
 
-        if self.get_project_totals(project)[1] + new_error > 0.25:
+        hours_list, error_list = closest_fraction_array(np.array([convert_time(times[n]) for n in selected]))
+
+        for n, hours, new_error in zip(selected, hours_list.tolist(), error_list.tolist()):
+            self.add_hours(projects[n], parsed_dates[n].day, hours, new_error)
+
+    def add_hours(self, project: str, day: int, hours: float, new_error: float):
+        """
+        Add rounded time data for a given project and day of the month.
+        The rounding errors are accumulated per project. An extra quarter of an hour is
+        charged every time the accumulated error gets bigger than a quarter of an hour.
+        :param project: project name
+        :param day: day of the month
+        :param hours: rounded number of hours
+        :param new_error: rounding error
+        """
+        old_error = self.project_errors.get(project, 0)
+        if old_error + new_error > 0.25:
             hours += 0.25
             new_error -= 0.25
 
-        if project in self.project_totals:
-            old_hours = self.project_totals[project][0]
-            old_error = self.project_totals[project][1]
-            self.project_totals[project] = (old_hours + hours, old_error + new_error)
-            # print('+', project, hours, old_hours, self.project_totals[project])
-        else:
-            self.project_totals[project] = (hours, new_error)
-
-        if dt.day in self.day_totals:
-            self.day_totals[dt.day] += hours
-        else:
-            self.day_totals[dt.day] = hours
-
-        key = (project, dt.day)
-        if key in self.data:
-            self.data[key] += hours
-        else:
-            self.data[key] = hours
+        self.project_hours[project] = self.project_hours.get(project, 0) + hours
+        self.project_errors[project] = old_error + new_error
+        # print('+', project, hours, self.project_hours[project], self.project_errors[project])
+
+        self.day_totals[day] = self.day_totals.get(day, 0) + hours
+
+        project_hours = self.data.setdefault(project, {})
+        project_hours[day] = project_hours.get(day, 0) + hours
 
     def get_hours(self, project: str, day: int):
         """
@@ -69,17 +108,21 @@ class Totals:
         :param day: day of the month
         :return:
         """
-        key = (project, day)
-        if key in self.data:
-            return self.data[key]
-        else:
-            return 0
+        return self.data.get(project, {}).get(day, 0)
+
+    def get_hours_dict(self, project: str) -> dict:
+        """
+        Get the hours spent on a given project for all the days with data
+        :param project: project name
+        :return: dictionary with the hours indexed by day of the month
+        """
+        return self.data.get(project, {})
 
     def get_project_list(self):
         """
         Get the list of projects where time was charged
         """
-        return list(self.project_totals.keys())
+        return list(self.project_hours.keys())
 
     def get_project_totals(self, project: str) -> tuple:
         """
@@ -88,10 +131,10 @@ class Totals:
         :param project: project name
         :return: tuple with the number of hours and the rounding error
         """
-        if project in self.project_totals:
-            return self.project_totals[project]
-        else:
+        hours = self.project_hours.get(project)
+        if hours is None:
             return 0, 0
+        return hours, self.project_errors[project]
 
     def get_day_totals(self, day: int) -> int:
         """
@@ -99,10 +142,7 @@ class Totals:
         :param day: day of the month
         :return: number of hours
         """
-        if day in self.day_totals:
-            return self.day_totals[day]
-        else:
-            return 0
+        return self.day_totals.get(day, 0)
 
     def get_total_time(self) -> int:
         """
@@ -118,13 +158,28 @@ class Totals:
         """
         print('-' * 40)
         print(self.get_project_list())
-        print(self.project_totals)
+        print(self.project_hours)
+        print(self.project_errors)
         print(self.day_totals)
-        for key in self.data:
-            print(key, self.data[key])
+        for project in self.data:
+            for day in self.data[project]:
+                print((project, day), self.data[project][day])
         print('-' * 40)
 
 
+@lru_cache(maxsize=64)
+def parse_date(date: str) -> datetime:
+    """
+    Convert a date in dd/mm/yyyy format to a datetime object.
+    The results are cached since most records share a small number of dates.
+    The date is split by hand since the format is fixed (strptime is much slower).
+    :param date: date
+    :return: datetime object
+    """
+    day, month, year = date.split('/')
+    return datetime(int(year), int(month), int(day))
+
+
 def closest_fraction(x: int | float):
     """
     Return the closest real to a given number whose fractional part is either 0, 0.25, 0.5 or 0.75.
@@ -148,9 +203,25 @@ def closest_fraction(x: int | float):
     return xt, dx
 
 
+def closest_fraction_array(x: np.ndarray) -> tuple:
+    """
+    Array version of closest_fraction. All the elements are rounded in one operation.
+    The fractional part of each element is mapped to 0, 0.25, 0.5, 0.75 or 1 using the same
+    thresholds used in closest_fraction.
+    :param x: array of numbers to approximate
+    :return: tuple with the array of closest numbers and the array of differences
+    """
+    xf, xi = np.modf(x)
+    xt = xi + ROUNDING_FRACTIONS[np.searchsorted(ROUNDING_THRESHOLDS, xf, side='left')]
+    dx = x - xt
+    dx = np.where(np.abs(dx) > 1.0E-4, dx, 0.0)
+    return xt, dx
+
+
 def read_project_list(file_name: str) -> list:
     """
     Read the contents of the file with the list of valid projects.
+    Empty lines and comments (lines starting with #) are ignored.
     :param file_name: project list file name
     :return: list of projects
     """
@@ -158,7 +229,8 @@ def read_project_list(file_name: str) -> list:
     with open(file_name, 'r') as f:
         for line in f:
             line = line.strip()
-            if not re.search('^#', line) or len(line) == 0:
+            # Skip comments and blank lines
+            if line and not line.startswith('#'):
                 output_list.append(line)
     return output_list
 
@@ -191,10 +263,7 @@ def column_name(column_number: int) -> str:
     :param column_number: column number (zero indexed)
     :return: column name
     """
-    column_list = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M',
-                   'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z',
-                   'AA', 'AB', 'AC', 'AD', 'AE', 'AF', 'AG', 'AH', 'AI', 'AJ', 'AK']
-    if column_number < len(column_list):
-        return column_list[column_number]
+    if 0 <= column_number < len(COLUMN_NAMES):
+        return COLUMN_NAMES[column_number]
     else:
         raise ValueError(f'Bad column number {column_number}')